@@ -1,12 +1,16 @@
 import importlib.resources
 import json
+from functools import lru_cache
 
 import numpy as np
-import pandas as pd
 
 from ..image import convert_nef_to_grey
 from ..plotting import plot_roi
-from ..utils import find_files, rodbard
+from ..utils import find_files, rodbard, rodbard_jacobian
+
+RODBARD_BOUNDS = ([0.0, -np.inf, 0.0, 0.0], [2**16, np.inf, np.inf, 2**16])
+# diagnostics returned by `fit_rodbard` with one entry per subject
+PER_SUBJECT_DIAGNOSTICS = ['residuals', 'covariance', 'rmse', 'converged', 'bad_fit']
 
 
 def get_image_patch(center_coord, square_apothem: int = 100):
@@ -25,7 +29,8 @@ def get_standard_value(array, medfilt_radius=40, square_size=900, roi_fig_name=N
     from skimage.segmentation import clear_border
     from skimage.util import img_as_ubyte
 
-    print(f'extracting ROI for {roi_fig_name.stem}')
+    if roi_fig_name:
+        print(f'extracting ROI for {roi_fig_name.stem}')
 
     center_coord = np.round(np.array(array.shape) / 2).astype(int)
 
@@ -99,16 +104,149 @@ def get_standard_value(array, medfilt_radius=40, square_size=900, roi_fig_name=N
     return np.median(gray[roi])
 
 
-def calibrate_standard(
-    sub_id, src_dir, standard_type, flatfield_correction=None, out_dir=None
-):
-    from scipy.optimize import curve_fit
+def fit_rodbard(std_rad, std_gv, p0=None, max_nfev=None, max_rel_rmse=0.02):
+    """
+    Fit four-parameter Rodbard curves to one or more sets of standards.
+
+    `std_rad` and `std_gv` have shape (n_standards,) or
+    (n_subjects, n_standards); all curves are fitted together in a single
+    call to `scipy.optimize.least_squares` with the analytic Jacobian.
+    Batched fits are toleranced jointly on the combined cost, so the
+    solver's convergence status is shared by all subjects and parameters
+    can differ slightly (~1e-4 relative) from fitting each subject alone.
+    `p0` optionally provides starting parameters (e.g. a previous fit)
+    with shape (4,) or (n_subjects, 4).
+
+    Returns the fitted parameters and a dict of fit diagnostics:
+    residuals, covariance, rmse, `converged` (solver success with a finite,
+    full rank solution) and `bad_fit`, which flags curves whose rmse
+    exceeds `max_rel_rmse` of that subject's grey value range.
+    """
+    from scipy.optimize import least_squares
+    from scipy.sparse import csr_matrix
+
+    single = np.ndim(std_gv) == 1
+    std_gv = np.atleast_2d(np.asarray(std_gv, dtype=float))
+    std_rad = np.broadcast_to(np.asarray(std_rad, dtype=float), std_gv.shape)
+    n_subj, n_std = std_gv.shape
+
+    lower, upper = RODBARD_BOUNDS
+    if p0 is None:
+        p0 = np.column_stack(
+            [
+                std_gv.min(axis=1),
+                np.ones(n_subj),
+                std_rad.mean(axis=1),
+                std_gv.max(axis=1),
+            ]
+        )
+    p0 = np.broadcast_to(np.asarray(p0, dtype=float), (n_subj, 4))
+    p0 = np.clip(p0, lower, upper)
+
+    def unpack(params):
+        # (n_subj * 4,) -> four (n_subj, 1) arrays to broadcast over standards
+        return params.reshape(n_subj, 4).T[..., None]
+
+    # each subject's residuals only depend on its own four parameters
+    jac_rows = np.repeat(np.arange(n_subj * n_std), 4)
+    jac_cols = np.broadcast_to(
+        np.arange(n_subj)[:, None, None] * 4 + np.arange(4), (n_subj, n_std, 4)
+    ).ravel()
+
+    def residuals(params):
+        return (rodbard(std_rad, *unpack(params)) - std_gv).ravel()
+
+    def jacobian(params):
+        jac = rodbard_jacobian(std_rad, *unpack(params))
+        if n_subj == 1:
+            return jac[0]
+        return csr_matrix(
+            (jac.ravel(), (jac_rows, jac_cols)), shape=(n_subj * n_std, n_subj * 4)
+        )
+
+    result = least_squares(
+        residuals,
+        p0.ravel(),
+        jac=jacobian,
+        bounds=(np.tile(lower, n_subj), np.tile(upper, n_subj)),
+        x_scale='jac',
+        max_nfev=max_nfev,
+    )
+
+    popt = result.x.reshape(n_subj, 4)
+    resid = result.fun.reshape(n_subj, n_std)
+    ssr = (resid**2).sum(axis=1)
+
+    # covariance as in `scipy.optimize.curve_fit`, one subject at a time
+    jac = rodbard_jacobian(std_rad, *unpack(result.x))
+    _, s, vt = np.linalg.svd(jac, full_matrices=False)
+    threshold = np.finfo(float).eps * max(n_std, 4) * s[:, :1]
+    nonzero = s > threshold
+    full_rank = nonzero.all(axis=1)
+    s_inv = np.zeros_like(s)
+    s_inv[nonzero] = 1.0 / s[nonzero] ** 2
+    pcov = np.einsum('nji,nj,njk->nik', vt, s_inv, vt)
+    pcov = pcov * (ssr / max(n_std - 4, 1))[:, None, None]
+    pcov[~full_rank] = np.inf
+
+    diagnostics = {
+        'residuals': resid,
+        'covariance': pcov,
+        'rmse': np.sqrt(ssr / n_std),
+        'converged': (
+            result.success
+            & full_rank
+            & np.isfinite(popt).all(axis=1)
+            & np.isfinite(resid).all(axis=1)
+        ),
+        'bad_fit': ~(
+            np.sqrt(ssr / n_std)
+            <= max_rel_rmse * np.ptp(std_gv, axis=1).clip(min=np.finfo(float).eps)
+        ),
+        'nfev': result.nfev,
+        'message': result.message,
+    }
+    if single:
+        popt = popt[0]
+        for key in PER_SUBJECT_DIAGNOSTICS:
+            diagnostics[key] = diagnostics[key][0]
+    return popt, diagnostics
+
+
+def failed_fit(n_std, message):
+    """NaN parameters and diagnostics for a fit the solver could not complete"""
+    return np.full(4, np.nan), {
+        'residuals': np.full(n_std, np.nan),
+        'covariance': np.full((4, 4), np.nan),
+        'rmse': np.nan,
+        'converged': False,
+        'bad_fit': True,
+        'nfev': 0,
+        'message': message,
+    }
+
+
+@lru_cache
+def load_standard_values(standard_type):
+    """Radioactivity of each standard, read once per process"""
+    import pandas as pd
 
     from .. import data
 
-    # load standard information
     with importlib.resources.open_text(data, 'standards.json') as f:
-        standard_vals = pd.read_json(f)[standard_type].dropna()
+        return pd.read_json(f)[standard_type].dropna()
+
+
+def measure_standards(
+    sub_id, src_dir, standard_type, flatfield_correction=None, out_dir=None, dtype=None
+):
+    """
+    Find the median grey value of each of a subject's standards,
+    returning a table of standard values and the standards' file stem
+    """
+    import pandas as pd
+
+    standard_vals = load_standard_values(standard_type)
 
     standard_files = find_files(src_dir.glob(f'*subj-{sub_id}*standard*.nef'))
     assert len(standard_files) == len(standard_vals)
@@ -121,6 +259,7 @@ def calibrate_standard(
                     crop_row=0.2,
                     crop_col=0.2,
                     flatfield_correction=flatfield_correction,
+                    dtype=dtype,
                 )
             ]
             for std in standard_files
@@ -137,25 +276,48 @@ def calibrate_standard(
 
     # reverse standards as image order is from darkest activity to lightest
     standards_df['radioactivity (uCi/g)'] = standard_vals.iloc[::-1].to_list()
+    return standards_df, standard_files[0].stem[:-3]
+
 
-    # Fit the model
-    X = standards_df['radioactivity (uCi/g)']
-    y = standards_df['median grey']
+def fit_standards(std_rad, std_gv, p0=None):
+    """
+    Fit a single Rodbard curve, falling back to the default starting
+    parameters if a warm start fails or does not converge. If the solver
+    fails from the default start too, NaN parameters are returned and the
+    fit is flagged as not converged and bad.
+    """
     # https://www.myassays.com/four-parameter-logistic-regression.html
-    print(f'fitting Rodbard curve for {standard_files[0].stem[:-3]}')
-    popt, _ = curve_fit(
-        rodbard,
-        X,
-        y,
-        p0=[y.min(), 1, X.mean(), y.max()],
-        bounds=([0.0, -np.inf, 0.0, 0.0], [2**16, np.inf, np.inf, 2**16]),
-        maxfev=5000,
-    )
+    if p0 is not None and not np.all(np.isfinite(p0)):
+        p0 = None
+    starts = [p0, None] if p0 is not None else [None]
+    for start in starts:
+        if start is None and p0 is not None:
+            print('warm-started fit failed, refitting from default start')
+        try:
+            popt, fit = fit_rodbard(std_rad, std_gv, p0=start)
+        except (ValueError, np.linalg.LinAlgError) as err:
+            popt, fit = failed_fit(len(std_gv), f'{type(err).__name__}: {err}')
+        if fit['converged']:
+            break
+
+    if not fit['converged']:
+        print(f'WARNING: Rodbard fit did not converge ({fit["message"]})')
+    elif fit['bad_fit']:
+        print(f'WARNING: poor Rodbard fit to standards (rmse {fit["rmse"]:.1f})')
+    return popt, fit
 
-    # save for calibrating slice images
-    out_stem = standard_files[0].stem[:-3]
-    if out_dir:
-        standards_df.to_json(f'{out_dir / out_stem}_standards.json')
-        with (out_dir / f'{out_stem}_calibration.json').open(mode='w') as f:
-            json.dump(dict(zip(['min', 'slope', 'ED50', 'max'], popt)), f)
-    return popt, X, y, out_stem
+
+def save_calibration(out_dir, out_stem, popt, fit):
+    with (out_dir / f'{out_stem}_calibration.json').open(mode='w') as f:
+        json.dump(dict(zip(['min', 'slope', 'ED50', 'max'], popt)), f)
+    with (out_dir / f'{out_stem}_fit.json').open(mode='w') as f:
+        json.dump(
+            {
+                'residuals': fit['residuals'].tolist(),
+                'covariance': fit['covariance'].tolist(),
+                'rmse': float(fit['rmse']),
+                'converged': bool(fit['converged']),
+                'bad_fit': bool(fit['bad_fit']),
+            },
+            f,
+        )
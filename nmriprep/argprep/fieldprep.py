@@ -5,17 +5,30 @@ import numpy as np
 
 from ..image import convert_nef_to_grey, read_tiff, save_slice
 from ..parser import get_fieldprep_parser
-from ..utils import find_files, parse_kv
+from ..utils import find_files, parse_kv, set_precision
 
 
 def find_fields(user=None, search_map=None):
-    fieldpath = user if user is not None else find_files(search_map)[-1]
+    if user is not None:
+        fieldpath = user
+    else:
+        found = find_files(search_map)
+        fieldpath = found[-1] if found else None
     field = read_tiff(fieldpath) if fieldpath else None
     return field
 
 
+def combine_fields(fnames):
+    """Median grey value image of repeated field acquisitions"""
+    return np.median(
+        np.stack([convert_nef_to_grey(fname) for fname in fnames], axis=2),
+        axis=2,
+    )
+
+
 def fieldprep():
     args = get_fieldprep_parser().parse_args()
+    set_precision(args.precision)
 
     if args.dark_field:
         raise NotImplementedError('Dark field processing coming soon...')
@@ -42,12 +55,5 @@ def fieldprep():
             )
             out_dir.mkdir(parents=True, exist_ok=True)
 
-            data = np.median(
-                np.stack(
-                    [convert_nef_to_grey(fname) for fname in sub_files],
-                    axis=2,
-                ),
-                axis=2,
-            )
-            save_slice(data, out_dir / f'{out_stem}_flatfield.tif')
+            save_slice(combine_fields(sub_files), out_dir / f'{out_stem}_flatfield.tif')
     return
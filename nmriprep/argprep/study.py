@@ -0,0 +1,274 @@
+from pathlib import Path
+
+import numpy as np
+
+from ..image import convert_nef_to_grey
+from ..utils import find_files, get_float_dtype, inverse_rodbard
+from .calibration import (
+    PER_SUBJECT_DIAGNOSTICS,
+    fit_rodbard,
+    fit_standards,
+    measure_standards,
+    save_calibration,
+)
+from .fieldprep import find_fields
+
+
+def get_subject_ids(src_dir):
+    """Identify subjects from the slide and standard file names"""
+    return sorted(
+        set(
+            [
+                part.split('-')[1]
+                for fpath in src_dir.glob('*.nef')
+                for part in fpath.stem.split('_')
+                if 'subj' in part
+            ]
+        )
+    )
+
+
+class Study:
+    """
+    Autoradiography data sharing a source directory and processing options.
+
+    Field images passed here are read once and shared by all subjects,
+    and each subject's session is kept so that its fields and calibration
+    are only loaded the first time they are needed. `precision` applies
+    to this study only; if not given, the global setting at construction
+    (see `set_precision`) is used.
+    """
+
+    def __init__(
+        self,
+        source_directory,
+        standard_type,
+        output=None,
+        flat_field=None,
+        dark_field=None,
+        crop_width=None,
+        crop_height=None,
+        rotate=0,
+        precision=None,
+    ):
+        self.src_dir = Path(source_directory).absolute()
+        self.out_dir = Path(output) if output else self.src_dir.parent / 'preproc'
+        self.standard_type = standard_type
+        self.flat_field = find_fields(flat_field) if flat_field else None
+        self.dark_field = find_fields(dark_field) if dark_field else None
+        self.crop_width = crop_width
+        self.crop_height = crop_height
+        self.rotate = rotate
+        self.dtype = get_float_dtype(precision)
+        self._sessions = {}
+
+    @property
+    def subject_ids(self):
+        return get_subject_ids(self.src_dir)
+
+    def subject(self, sub_id):
+        if sub_id not in self._sessions:
+            self._sessions[sub_id] = SubjectSession(self, sub_id)
+        return self._sessions[sub_id]
+
+    def subjects(self, subject_ids=None):
+        """Yield a session for each (or each requested) subject"""
+        for sub_id in self.subject_ids:
+            if subject_ids is None or sub_id in subject_ids:
+                yield self.subject(sub_id)
+
+    def calibrate_all(self, subject_ids=None):
+        """
+        Refit every (or each requested) subject's standards in a single
+        batched call, returning the fitted parameters by subject.
+
+        Standards are only read for subjects not measured before, so
+        recalibrating the whole study is cheap. See `fit_rodbard` for how
+        batched fits are toleranced. If the batched solve fails, subjects
+        are fitted one at a time so that only the failing ones are flagged.
+        """
+        sessions = list(self.subjects(subject_ids))
+        for session in sessions:
+            session.measure()
+
+        try:
+            popt, fit = fit_rodbard(
+                np.stack([session.std_rad.to_numpy() for session in sessions]),
+                np.stack([session.std_gv.to_numpy() for session in sessions]),
+            )
+        except (ValueError, np.linalg.LinAlgError) as err:
+            print(f'Batched fit failed ({err}), fitting subjects one at a time')
+            for session in sessions:
+                print(f'fitting Rodbard curve for {session.std_stem}')
+                session.popt, session.fit = fit_standards(
+                    session.std_rad.to_numpy(), session.std_gv.to_numpy()
+                )
+        else:
+            for idx, session in enumerate(sessions):
+                session.popt = popt[idx]
+                session.fit = {
+                    key: val[idx] if key in PER_SUBJECT_DIAGNOSTICS else val
+                    for key, val in fit.items()
+                }
+                if not session.fit['converged'] or session.fit['bad_fit']:
+                    print(f'WARNING: poor Rodbard fit for {session.sub_id}')
+        return {session.sub_id: session.popt for session in sessions}
+
+
+class SubjectSession:
+    """
+    Fields, calibration and slide conversion for a single subject
+    """
+
+    def __init__(self, study, sub_id):
+        self.study = study
+        self.sub_id = sub_id
+        self.sub_dir = study.out_dir / sub_id
+        self.standards = None
+        self.std_stem = None
+        self._std_out_dir = None
+        self.popt = None
+        self.fit = None
+        self._flatfield_correction = None
+
+    @property
+    def flatfield_correction(self):
+        if self._flatfield_correction is None:
+            # fall back to fields produced by fieldprep for this subject
+            fields = {
+                'dark': self.study.dark_field,
+                'flat': self.study.flat_field,
+            }
+            for key in fields:
+                if fields[key] is None:
+                    fields[key] = find_fields(
+                        search_map=self.sub_dir.glob(f'*{key}field.tif*')
+                    )
+            if any(v is None for v in fields.values()):
+                print('Skipping flat field correction...')
+                fields = {}
+            self._flatfield_correction = fields
+        return self._flatfield_correction or None
+
+    @property
+    def std_rad(self):
+        return self.standards['radioactivity (uCi/g)']
+
+    @property
+    def std_gv(self):
+        return self.standards['median grey']
+
+    @property
+    def slide_files(self):
+        slide_files = find_files(
+            self.study.src_dir.glob(f'*subj-{self.sub_id}*slide*.nef')
+        )
+        if len(slide_files) < 1:
+            raise FileNotFoundError(
+                f'No slide files found for {self.sub_id} in {self.study.src_dir}'
+            )
+        return slide_files
+
+    def measure(self, out_dir=None):
+        """
+        Read this subject's standards, if not already measured.
+
+        If `out_dir` is given, the standard values and ROI figures are
+        written there, re-reading the standards if they were measured
+        without writing to that directory.
+        """
+        if self.standards is None or (out_dir and out_dir != self._std_out_dir):
+            standards_df, self.std_stem = measure_standards(
+                self.sub_id,
+                self.study.src_dir,
+                self.study.standard_type,
+                flatfield_correction=self.flatfield_correction,
+                out_dir=out_dir,
+                dtype=self.study.dtype,
+            )
+            if out_dir:
+                standards_df.to_json(f'{out_dir / self.std_stem}_standards.json')
+                self._std_out_dir = out_dir
+            # the cropped standard images are not needed after measurement
+            self.standards = standards_df.drop(columns='gv_array')
+        return self.standards
+
+    def calibrate(self, p0=None, out_dir=None):
+        """
+        Fit the Rodbard curve to this subject's standards.
+
+        The standards are only read the first time (or when first written
+        to `out_dir`), so refitting (e.g. starting from another subject's
+        fit) does not touch the disk.
+        """
+        self.measure(out_dir=out_dir)
+        print(f'fitting Rodbard curve for {self.std_stem}')
+        self.popt, self.fit = fit_standards(
+            self.std_rad.to_numpy(), self.std_gv.to_numpy(), p0=p0
+        )
+        if out_dir:
+            save_calibration(out_dir, self.std_stem, self.popt, self.fit)
+        return self.popt
+
+    def grey(self, slide_file):
+        """Inverted, cropped and rotated grey values of a slide"""
+        grey = convert_nef_to_grey(
+            slide_file,
+            flatfield_correction=self.flatfield_correction,
+            crop_row=self.study.crop_height,
+            crop_col=self.study.crop_width,
+            invert=True,
+            dtype=self.study.dtype,
+        )
+        if self.study.rotate > 0:
+            grey = np.rot90(grey, k=self.study.rotate)
+        return grey
+
+    def grey_stack(self):
+        return np.stack([self.grey(fname) for fname in self.slide_files], axis=2)
+
+    def to_radioactivity(self, grey):
+        if self.popt is None:
+            self.calibrate()
+        data_radioactivity = inverse_rodbard(grey, *self.popt, dtype=self.study.dtype)
+        # clip "negative" values
+        data_radioactivity[np.isnan(data_radioactivity)] = 0
+        return data_radioactivity
+
+    def iter_slides(self, roi_dir=None, roi_suffix='rois'):
+        """
+        Yield the grey values and radioactivity of each slide in turn.
+
+        If `roi_dir` is given, values are also extracted from the
+        napari `ROI manager` file drawn on each slide's preprocessed tif.
+        """
+        import pandas as pd
+
+        from ..measure import measure_rois, result_to_df
+
+        # list the ROI files once rather than walking the tree per slide
+        roi_files = (
+            find_files(Path(roi_dir).rglob(f'*{roi_suffix}.json'))
+            if roi_dir is not None
+            else []
+        )
+        for fname in self.slide_files:
+            grey = self.grey(fname)
+            result = {
+                'file': fname,
+                'grey': grey,
+                'radioactivity': self.to_radioactivity(grey),
+            }
+            if roi_dir is not None:
+                roi_file = next(
+                    (f for f in roi_files if f.name.startswith(f'{fname.stem}_')),
+                    None,
+                )
+                result['rois'] = (
+                    result_to_df(
+                        measure_rois(result['radioactivity'], pd.read_json(roi_file))
+                    )
+                    if roi_file
+                    else None
+                )
+            yield result
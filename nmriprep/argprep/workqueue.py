@@ -0,0 +1,229 @@
+"""
+File-based work queue for spreading argprep subjects over many nodes.
+
+Only a shared filesystem is required. Each subject is a JSON task file
+that moves between state directories with atomic renames:
+
+    <queue>/pending/<subject>.json
+    <queue>/claimed/<subject>.json
+    <queue>/done/<subject>.json
+    <queue>/failed/<subject>.json
+
+Workers refresh the modification time of their claimed task as a
+heartbeat, and claims without a heartbeat for `stale_after` seconds
+are moved back to `pending` (or to `failed` once out of attempts) by
+any other worker. Workers keep polling until no task is pending or
+claimed, so a subject claimed by a crashed node is never left behind.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime
+
+STATES = ['pending', 'claimed', 'done', 'failed']
+
+
+def get_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def timestamp():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def read_task(path):
+    with path.open() as f:
+        return json.load(f)
+
+
+def write_task(path, task):
+    # write to a hidden file first so readers never see a partial task
+    tmp = path.with_name(f'.{path.name}.{get_worker_id()}.tmp')
+    with tmp.open(mode='w') as f:
+        json.dump(task, f, indent=2)
+    tmp.replace(path)
+
+
+def queue_status(queue_dir):
+    return {state: len(list((queue_dir / state).glob('*.json'))) for state in STATES}
+
+
+def submit_tasks(queue_dir, subject_ids):
+    """
+    Write a pending task for each subject not already in the queue
+    """
+    for state in STATES:
+        (queue_dir / state).mkdir(parents=True, exist_ok=True)
+
+    for sub_id in subject_ids:
+        fname = f'{sub_id}.json'
+        existing = [state for state in STATES if (queue_dir / state / fname).exists()]
+        if existing:
+            print(f'Skipping {sub_id}: already {existing[0]}')
+            continue
+        write_task(
+            queue_dir / 'pending' / fname,
+            {
+                'subject': sub_id,
+                'attempts': 0,
+                'submitted': timestamp(),
+                'history': [],
+            },
+        )
+    print(f'Queue status: {queue_status(queue_dir)}')
+
+
+def fail_task(queue_dir, path, task, error):
+    """Move a task that has used all of its attempts to failed"""
+    failed = queue_dir / 'failed' / path.name
+    try:
+        path.rename(failed)
+    except FileNotFoundError:
+        # moved by another worker in the meantime
+        return
+    task['history'].append({'finished': timestamp(), 'error': error})
+    write_task(failed, task)
+    print(f'Marked {task["subject"]} as failed: {error}')
+
+
+def reclaim_stale(queue_dir, stale_after, max_attempts):
+    """
+    Move claimed tasks without a recent heartbeat back to pending,
+    or to failed if they have no attempts left (e.g. the subject
+    repeatedly kills its node)
+    """
+    for path in (queue_dir / 'claimed').glob('*.json'):
+        try:
+            if time.time() - path.stat().st_mtime < stale_after:
+                continue
+            task = read_task(path)
+            if task['attempts'] >= max_attempts:
+                fail_task(queue_dir, path, task, 'worker lost on final attempt')
+                continue
+            # move the claim out of sight before recording the reclaim, so that
+            # no other worker can pick up the task while it is being rewritten
+            reclaiming = path.with_name(f'.{path.stem}.{get_worker_id()}.reclaim')
+            path.rename(reclaiming)
+        except FileNotFoundError:
+            # finished or reclaimed by another worker in the meantime
+            continue
+        task = read_task(reclaiming)
+        task['history'].append(
+            {
+                'worker': task.get('worker'),
+                'reclaimed': timestamp(),
+                'error': f'no heartbeat for {stale_after} seconds',
+            }
+        )
+        write_task(reclaiming, task)
+        reclaiming.rename(queue_dir / 'pending' / path.name)
+        print(f'Reclaimed stale task {path.stem}')
+
+
+def claim_task(queue_dir):
+    """
+    Atomically move the first available pending task to claimed
+    """
+    for path in sorted((queue_dir / 'pending').glob('*.json')):
+        claimed = queue_dir / 'claimed' / path.name
+        try:
+            path.rename(claimed)
+            # rename keeps the old mtime, which would make the claim look stale
+            os.utime(claimed)
+        except FileNotFoundError:
+            # another worker claimed (or reclaimed) it first
+            continue
+        return claimed
+    return None
+
+
+def heartbeat(path, interval, stop):
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+def run_worker(queue_dir, process, max_attempts=3, stale_after=600, poll_interval=30):
+    """
+    Claim and process tasks until no task is pending or claimed,
+    polling every `poll_interval` seconds while other workers' claims
+    are outstanding in case they go stale.
+
+    `process` is called as `process(subject, p0)` and its return value
+    is passed as `p0` for the next subject, so each calibration fit is
+    warm started from whichever subject this worker processed last.
+    """
+    worker_id = get_worker_id()
+    print(f'Starting worker {worker_id} on {queue_dir}')
+    p0 = None
+    while True:
+        reclaim_stale(queue_dir, stale_after, max_attempts)
+        claimed = claim_task(queue_dir)
+        if claimed is None:
+            if not any((queue_dir / 'claimed').glob('*.json')):
+                break
+            time.sleep(min(poll_interval, stale_after))
+            continue
+
+        try:
+            task = read_task(claimed)
+        except FileNotFoundError:
+            print(f'Lost claim on {claimed.stem} before starting, skipping')
+            continue
+        if task['attempts'] >= max_attempts:
+            fail_task(queue_dir, claimed, task, 'no attempts left')
+            continue
+        task['attempts'] += 1
+        task['worker'] = worker_id
+        started = timestamp()
+        write_task(claimed, task)
+        print(f'Claimed {task["subject"]} (attempt {task["attempts"]})')
+
+        stop = threading.Event()
+        beat = threading.Thread(
+            target=heartbeat, args=(claimed, stale_after / 4, stop), daemon=True
+        )
+        beat.start()
+        error = None
+        try:
+            p0 = process(task['subject'], p0)
+        except Exception:
+            error = traceback.format_exc()
+            print(f'Failed to process {task["subject"]}:\n{error}')
+        finally:
+            stop.set()
+            beat.join()
+
+        task['history'].append(
+            {
+                'worker': worker_id,
+                'started': started,
+                'finished': timestamp(),
+                'error': error,
+            }
+        )
+        if error is None:
+            state = 'done'
+        elif task['attempts'] >= max_attempts:
+            state = 'failed'
+        else:
+            state = 'pending'
+
+        try:
+            owner = read_task(claimed).get('worker')
+        except FileNotFoundError:
+            owner = None
+        if owner != worker_id:
+            print(f'Claim on {task["subject"]} was reclaimed, discarding result')
+            continue
+        write_task(claimed, task)
+        claimed.replace(queue_dir / state / claimed.name)
+        print(f'Marked {task["subject"]} as {state}')
+
+    print(f'No tasks left. Queue status: {queue_status(queue_dir)}')
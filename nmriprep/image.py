@@ -1,11 +1,11 @@
 import numpy as np
-import rawpy
-from PIL import Image
 
 from .utils import rgb_to_grey, symmetrical_crop
 
 
 def read_nef(path_to_file: str):
+    import rawpy
+
     with rawpy.imread(path_to_file) as raw:
         return raw.postprocess(
             use_camera_wb=True, no_auto_scale=True, no_auto_bright=True, output_bps=16
@@ -13,11 +13,15 @@ def read_nef(path_to_file: str):
 
 
 def read_tiff(path_to_file):
+    from PIL import Image
+
     with Image.open(path_to_file) as img:
         return np.array(img)
 
 
 def save_slice(array, out_name):
+    from PIL import Image
+
     im = Image.fromarray(array).save(out_name)
     return im
 
@@ -28,11 +32,14 @@ def convert_nef_to_grey(
     crop_col=None,
     flatfield_correction=None,
     invert=False,
+    dtype=None,
 ):
     # Load the NEF file using rawpy
     print(f'Reading {nef_file.name}')
     rgb = read_nef(str(nef_file))
-    grey = rgb_to_grey(rgb, flatfield_corr=flatfield_correction, invert=invert)
+    grey = rgb_to_grey(
+        rgb, flatfield_corr=flatfield_correction, invert=invert, dtype=dtype
+    )
 
     if crop_row:
         row_lim = symmetrical_crop(grey.shape[0], crop_row)
@@ -1,10 +1,11 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import pandas as pd
-from skimage.measure import grid_points_in_poly
 
 from .image import read_tiff
 from .parser import get_roiextract_parser
-from .utils import normalise_by_region, parse_kv
+from .utils import find_files, normalise_by_region, parse_kv
 
 
 def summarise_vals(
@@ -19,6 +20,158 @@ def summarise_vals(
     ).drop(columns=col)
 
 
+def measure_rois(img_data, roi_df):
+    """
+    Extract the values within each polygon of a napari `ROI manager`
+    table from an image array, as a compact columnar result
+    """
+    from skimage.measure import grid_points_in_poly
+
+    values = [
+        img_data[grid_points_in_poly(img_data.shape, poly)] for poly in roi_df['data']
+    ]
+    return {
+        'names': [parse_kv(name) for name in roi_df['names']],
+        'values': np.concatenate(values) if values else np.array([]),
+        'offsets': np.cumsum([len(val) for val in values])[:-1],
+    }
+
+
+def extract_roi_file(roi_file, img_file):
+    """
+    Extract values from every ROI in a single napari `ROI manager` file.
+
+    Returns a status string and a compact, columnar result so that it can
+    be cheaply passed back from a worker process: ROI names and image
+    key-values as plain dicts, and all ROI values concatenated into a
+    single array alongside the offsets at which to split it.
+    """
+    import pandas as pd
+
+    try:
+        result = measure_rois(read_tiff(img_file), pd.read_json(roi_file))
+        result['info'] = parse_kv(img_file.stem)
+        return 'ok', result
+    except Exception as err:
+        return 'error', f'{type(err).__name__}: {err}'
+
+
+def result_to_df(result):
+    """
+    Rebuild a per-ROI DataFrame from the output of `measure_rois`
+    """
+    import pandas as pd
+
+    out_df = pd.DataFrame(result['names'])
+    out_df['values'] = np.split(result['values'], result['offsets'])
+    return out_df.assign(**result.get('info', {}))
+
+
+def extract_roi_dir(input_dir, roi_suffix='rois', img_suffix='ARG', jobs=1):
+    """
+    Extract values from all ROI files in a directory tree.
+
+    Returns one row per ROI (or None if no ROI files are found) and a
+    table of the ROI files that were excluded or failed, with reasons.
+    """
+    import pandas as pd
+
+    skipped = []
+
+    def skip(roi_file, status, reason):
+        print(f'{status.capitalize()} {roi_file.name}: {reason}')
+        skipped.append({'roi_file': str(roi_file), 'status': status, 'reason': reason})
+
+    # find the ROI files
+    roi_files = find_files(input_dir.rglob(f'*{roi_suffix}.json'))
+    if not roi_files:
+        print('No ROI files found')
+        return None, pd.DataFrame(skipped, columns=['roi_file', 'status', 'reason'])
+
+    # index the image files once rather than walking the tree per ROI file
+    img_index = {}
+    for img_file in find_files(input_dir.rglob(f'*{img_suffix}.tif*')):
+        img_index.setdefault(img_file.name.split('.tif')[0], img_file)
+
+    tasks = []
+    for roi_file in roi_files:
+        img_file = img_index.get(roi_file.stem.replace(roi_suffix, img_suffix))
+        if img_file is None:
+            skip(roi_file, 'failed', 'no image file found')
+        elif any(['exclu' in str(path) for path in [img_file, roi_file]]):
+            skip(roi_file, 'excluded', f'excluded path {img_file}')
+        else:
+            tasks.append((roi_file, img_file))
+
+    task_roi_files = [roi_file for roi_file, _ in tasks]
+    task_img_files = [img_file for _, img_file in tasks]
+    if jobs > 1:
+        print(f'Processing {len(tasks)} ROI files with {jobs} workers')
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # map preserves input order, so the merged output is deterministic
+            results = list(
+                executor.map(
+                    extract_roi_file,
+                    task_roi_files,
+                    task_img_files,
+                    chunksize=max(1, len(tasks) // (jobs * 4)),
+                )
+            )
+    else:
+        results = map(extract_roi_file, task_roi_files, task_img_files)
+
+    roi_values = []
+    for roi_file, (status, result) in zip(task_roi_files, results):
+        if status == 'error':
+            skip(roi_file, 'failed', result)
+        else:
+            print(f'Processed {roi_file.name}')
+            roi_values.append(result_to_df(result))
+
+    skipped_df = pd.DataFrame(skipped, columns=['roi_file', 'status', 'reason'])
+    if not roi_values:
+        raise RuntimeError(f'No ROI values could be extracted from {input_dir}')
+    return pd.concat(roi_values, ignore_index=True), skipped_df
+
+
+def summarise_rois(main_df, norm_regions=None):
+    """
+    Summarise values of each ROI, adding values normalised to each of
+    `norm_regions` to `main_df` and to the summary table
+    """
+    summary_df = summarise_vals(main_df)
+    if norm_regions:
+        merge_keys = [col for col in summary_df.columns if 'values' not in col]
+        for region in norm_regions:
+            array_col = f'{region}_values'
+            main_df[array_col] = normalise_by_region(main_df, region)
+            summary_df = summary_df.merge(
+                summarise_vals(
+                    main_df[merge_keys + [array_col]],
+                    funcs=[np.median, np.mean, np.min, np.max, np.std],
+                    col=array_col,
+                ),
+                how='left',
+                on=merge_keys,
+                validate='1:1',
+            )
+    return summary_df
+
+
+def group_rois(main_df, grouping_vars):
+    """
+    Median of the values pooled across all ROIs in each group
+    """
+    return main_df.groupby(grouping_vars, as_index=False, dropna=False).agg(
+        {
+            col: lambda x: np.median(np.concatenate([np.atleast_1d(val) for val in x]))
+            for col in main_df.columns
+            if 'value' in col
+        }
+        # before taking the median, create an aggregate array from all values
+    )
+
+
 def roi_extract():
     """
     Extract data from napari `ROI manager` plugin files
@@ -26,66 +179,34 @@ def roi_extract():
     """
     args = get_roiextract_parser().parse_args()
     input_dir = args.source_directory.absolute()
-    roi_suffix = args.roi_suffix
-    img_suffix = args.image_suffix
     output_name = args.output
 
-    # find the ROI files
-    roi_files = input_dir.rglob(f'*{roi_suffix}.json')
-    if not roi_files:
-        print('No ROI files found')
+    main_df, skipped_df = extract_roi_dir(
+        input_dir,
+        roi_suffix=args.roi_suffix,
+        img_suffix=args.image_suffix,
+        jobs=args.jobs,
+    )
+    if main_df is None:
+        return
+    if not skipped_df.empty:
+        skipped_df.to_csv(input_dir / f'{output_name}_skipped.csv', index=False)
+
+    summary_df = summarise_rois(main_df, norm_regions=args.norm_regions)
+    summary_df.to_csv(input_dir / f'{output_name}_summary.csv', index=False)
+
+    if args.grouping_vars:
+        group_rois(main_df, args.grouping_vars).to_csv(
+            input_dir / f'{output_name}_grouped_median.csv', index=False
+        )
     else:
-        roi_values = []
-        for roi_file in roi_files:
-            print(f'Processing {roi_file.name}')
-            # read the corresponding image file and confirm it exists
-            img_file = list(
-                input_dir.rglob(roi_file.stem.replace(roi_suffix, f'{img_suffix}.tif*'))
-            )[0]
-            if any(['exclu' in str(path) for path in [img_file, roi_file]]):
-                print(f'Excluding {roi_file}')
-                continue
-            img_data = read_tiff(img_file)
-            img_info = parse_kv(img_file.stem)
-
-            roi_df = pd.read_json(roi_file)
-            out_df = roi_df['names'].apply(parse_kv).apply(pd.Series)
-            out_df['values'] = roi_df['data'].apply(
-                lambda x: img_data[grid_points_in_poly(img_data.shape, x)]
-            )
-            out_df = out_df.assign(**img_info)
-            roi_values.append(out_df)
-
-        main_df = pd.concat(roi_values, ignore_index=True)
-        summary_df = summarise_vals(main_df)
-        if args.norm_regions:
-            merge_keys = [col for col in summary_df.columns if 'values' not in col]
-            for region in args.norm_regions:
-                array_col = f'{region}_values'
-                main_df[array_col] = normalise_by_region(main_df, region)
-                summary_df = summary_df.merge(
-                    summarise_vals(
-                        main_df[merge_keys + [array_col]],
-                        funcs=[np.median, np.mean, np.min, np.max, np.std],
-                        col=array_col,
-                    ),
-                    how='left',
-                    on=merge_keys,
-                    validate='1:1',
-                )
-        summary_df.to_csv(input_dir / f'{output_name}_summary.csv', index=False)
-
-        if args.grouping_vars:
-            main_df.groupby(args.grouping_vars, as_index=False, dropna=False).agg(
-                {
-                    col: lambda x: np.median(
-                        np.concatenate([np.atleast_1d(val) for val in x])
-                    )
-                    for col in main_df.columns
-                    if 'value' in col
-                }
-                # before taking the median, create an aggregate array from all values
-            ).to_csv(input_dir / f'{output_name}_grouped_median.csv', index=False)
-        else:
-            main_df.to_json(input_dir / f'{output_name}.json')
+        main_df.to_json(input_dir / f'{output_name}.json')
+
+    n_failed = (skipped_df['status'] == 'failed').sum()
+    if n_failed:
+        # outputs are still written, but batch jobs must not report success
+        sys.exit(
+            f'{n_failed} ROI file(s) could not be processed, '
+            + f'see {output_name}_skipped.csv'
+        )
     return
@@ -29,6 +29,12 @@ def get_argprep_parser():
     parser.add_argument(
         '--rotate', help='number of 90º CW rotations', type=int, default=0
     )
+    parser.add_argument(
+        '--precision',
+        help='floating point precision of image buffers and outputs',
+        choices=['float32', 'float64'],
+        default='float64',
+    )
     parser.add_argument(
         '--save-intermediate',
         help='generate content for assessment',
@@ -45,6 +51,29 @@ def get_argprep_parser():
     parser.add_argument(
         '--subject-id', help='optional list of subject IDs to process', nargs='*'
     )
+    parser.add_argument(
+        '--queue',
+        help='shared directory of subject tasks; without --worker, '
+        + 'write a task for each subject to process',
+        type=Path,
+    )
+    parser.add_argument(
+        '--worker',
+        help='claim and process subject tasks from --queue until it is empty',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--max-attempts',
+        help='number of times a subject task is attempted before it is failed',
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        '--stale-after',
+        help='seconds without a heartbeat before a claimed task is reclaimed',
+        type=float,
+        default=600,
+    )
     return parser
 
 
@@ -64,6 +93,12 @@ def get_fieldprep_parser():
     parser.add_argument(
         '--output', help='Optionally specify output directory', type=Path
     )
+    parser.add_argument(
+        '--precision',
+        help='floating point precision of image buffers and outputs',
+        choices=['float32', 'float64'],
+        default='float64',
+    )
     return parser
 
 
@@ -97,4 +132,10 @@ def get_roiextract_parser():
     parser.add_argument(
         '--output', help='name of output .json file', default='roi_values', type=str
     )
+    parser.add_argument(
+        '--jobs',
+        help='number of worker processes used to extract ROI files',
+        type=int,
+        default=1,
+    )
     return parser
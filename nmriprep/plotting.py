@@ -1,11 +1,33 @@
-import matplotlib.pyplot as plt
 import numpy as np
-from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+
+def get_pyplot():
+    """
+    Import pyplot on first use with a non-interactive backend, as figures
+    are only ever written to file. A backend chosen by the user (through
+    `matplotlib.use`, matplotlibrc, MPLBACKEND or an already imported
+    pyplot, e.g. in a notebook) is left untouched.
+    """
+    import sys
+
+    import matplotlib
+
+    # None unless a backend has been set explicitly (matplotlib >= 3.5)
+    if (
+        'matplotlib.pyplot' not in sys.modules
+        and matplotlib.rcParams._get_backend_or_none() is None
+    ):
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    return plt
 
 
 def plot_curve(
     std_rad, std_gv, fitted_gv, out_dir, out_stem, data_rad=None, data_gv=None
 ):
+    plt = get_pyplot()
+
     if data_rad is not None and data_gv is not None:
         plt.scatter(data_rad, data_gv, label='Data values', alpha=0.5)
     plt.plot(std_rad, fitted_gv, label='Curve fit', color='black')
@@ -22,6 +44,7 @@ def plot_curve(
 def plot_roi(array, roi, out_name):
     from skimage.measure import find_contours
 
+    plt = get_pyplot()
     contour = find_contours(roi)[0]
 
     plt.imshow(array, cmap='gray_r', vmin=60000, vmax=2**16)
@@ -34,6 +57,8 @@ def plot_roi(array, roi, out_name):
 
 
 def plot_single_slice(array, out_name):
+    plt = get_pyplot()
+
     plt.imshow(array / 1000, cmap='magma', vmax=2)
     plt.axis('off')
     plt.colorbar()
@@ -61,6 +86,10 @@ def optimal_subplot_grid(n):
 
 
 def plot_mosaic(array, out_name):
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+    plt = get_pyplot()
+
     # reshape 3d stack to 2d mosaic
     n = array.shape[-1]
     nrows, ncols = optimal_subplot_grid(n)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from nmriprep.argprep import calibration
+from nmriprep.argprep.calibration import fit_standards, load_standard_values
+from nmriprep.utils import rodbard, rodbard_jacobian
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        (3000, 1.2, 40, 60000),
+        (3000, -0.5, 40, 60000),
+        (60000, 35, 40, 3000),
+    ],
+)
+def test_jacobian_matches_finite_differences(params):
+    # include the background standard at x = 0
+    x = np.concatenate([[0.0], load_standard_values('H3').to_numpy()])
+    jac = rodbard_jacobian(x, *params)
+    assert np.isfinite(jac).all()
+
+    steps = 1e-6 * np.maximum(np.abs(params), 1)
+    for idx, step in enumerate(steps):
+        up, down = list(params), list(params)
+        up[idx] += step
+        down[idx] -= step
+        numeric = (rodbard(x, *up) - rodbard(x, *down)) / (2 * step)
+        np.testing.assert_allclose(
+            jac[:, idx], numeric, rtol=1e-5, atol=1e-6 * np.abs(numeric).max()
+        )
+
+
+def test_flat_standards_are_flagged():
+    std_rad = load_standard_values('H3').to_numpy()
+    popt, fit = fit_standards(std_rad, np.full(std_rad.size, 1000.0))
+    assert popt.shape == (4,)
+    assert not fit['converged'] or fit['bad_fit']
+
+
+def test_solver_failure_returns_nan(monkeypatch):
+    def broken_fit(*_args, **_kwargs):
+        raise ValueError('array must not contain infs or NaNs')
+
+    monkeypatch.setattr(calibration, 'fit_rodbard', broken_fit)
+    std_rad = load_standard_values('H3').to_numpy()
+    popt, fit = fit_standards(std_rad, rodbard(std_rad, 3000, 1.2, 40, 60000))
+    assert np.isnan(popt).all()
+    assert not fit['converged']
+    assert fit['bad_fit']
+    assert fit['residuals'].shape == std_rad.shape
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+from nmriprep.measure import extract_roi_dir
+
+
+@pytest.fixture
+def roi_dir(tmp_path):
+    rng = np.random.default_rng(0)
+    for subj in ['01', '02']:
+        sub_dir = tmp_path / subj
+        sub_dir.mkdir()
+        for section in range(1, 6):
+            stem = f'subj-{subj}_slide-01_section-{section}_desc-preproc'
+            Image.fromarray(rng.uniform(0, 100, (60, 80)).astype(np.float32)).save(
+                sub_dir / f'{stem}_ARG.tif'
+            )
+            pd.DataFrame(
+                {
+                    'names': ['region-ctx_hemi-L', 'region-str_hemi-R'],
+                    'data': [
+                        [[5, 5], [5, 30], [30, 30], [30, 5]],
+                        [[35, 40], [35, 70], [55, 70]],
+                    ],
+                }
+            ).to_json(sub_dir / f'{stem}_rois.json')
+    # an ROI file without its image
+    (tmp_path / '02' / 'subj-02_slide-01_section-9_desc-preproc_rois.json').write_text(
+        '{}'
+    )
+    return tmp_path
+
+
+def test_parallel_matches_serial(roi_dir):
+    serial_df, serial_skipped = extract_roi_dir(roi_dir, jobs=1)
+    parallel_df, parallel_skipped = extract_roi_dir(roi_dir, jobs=2)
+
+    assert len(serial_df) == 20
+    assert list(serial_df['subj']) == ['01'] * 10 + ['02'] * 10
+    pd.testing.assert_frame_equal(
+        serial_df.drop(columns='values'), parallel_df.drop(columns='values')
+    )
+    for serial, parallel in zip(serial_df['values'], parallel_df['values']):
+        np.testing.assert_array_equal(serial, parallel)
+    pd.testing.assert_frame_equal(serial_skipped, parallel_skipped)
+
+
+def test_failed_files_are_reported(roi_dir):
+    _, skipped_df = extract_roi_dir(roi_dir)
+    assert skipped_df['status'].tolist() == ['failed']
+    assert skipped_df['roi_file'].iloc[0].endswith('section-9_desc-preproc_rois.json')
@@ -0,0 +1,32 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    ('setup', 'expected'),
+    [
+        ('', 'agg 0'),
+        ("matplotlib.use('svg')", 'svg 0'),
+        (
+            "matplotlib.use('pdf'); import matplotlib.pyplot as plt; plt.figure()",
+            'pdf 1',
+        ),
+    ],
+)
+def test_get_pyplot_respects_chosen_backend(setup, expected, monkeypatch):
+    monkeypatch.delenv('MPLBACKEND', raising=False)
+    code = '\n'.join(
+        [
+            'import matplotlib',
+            setup,
+            'from nmriprep.plotting import get_pyplot',
+            'plt = get_pyplot()',
+            'print(plt.get_backend().lower(), len(plt.get_fignums()))',
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == expected
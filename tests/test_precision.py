@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from nmriprep.argprep.calibration import fit_rodbard, load_standard_values
+from nmriprep.utils import inverse_rodbard, rgb_to_grey, rodbard, set_precision
+
+
+@pytest.fixture
+def calibrated_slide():
+    """Seeded 16-bit slide, flat/dark fields and a fitted H3 calibration"""
+    rng = np.random.default_rng(0)
+    std_rad = load_standard_values('H3').to_numpy()
+    std_gv = rodbard(std_rad, 3000, 1.2, 40, 60000) + rng.normal(0, 50, std_rad.size)
+    popt, _ = fit_rodbard(std_rad, std_gv)
+    rgb = rng.integers(20000, 60000, (500, 600, 3), dtype=np.uint16)
+    fields = {
+        'flat': rng.normal(40000, 2000, (500, 600)),
+        'dark': rng.normal(500, 20, (500, 600)),
+    }
+    yield rgb, fields, popt
+    set_precision('float64')
+
+
+def process(rgb, fields, popt, precision):
+    set_precision(precision)
+    grey = rgb_to_grey(rgb, flatfield_corr=fields, invert=True)
+    radioactivity = inverse_rodbard(grey, *popt)
+    radioactivity[np.isnan(radioactivity)] = 0
+    return grey, radioactivity
+
+
+def test_float32_matches_float64(calibrated_slide):
+    grey64, rad64 = process(*calibrated_slide, 'float64')
+    grey32, rad32 = process(*calibrated_slide, 'float32')
+    assert rad32.dtype == np.float32
+    assert rad64.dtype == np.float64
+
+    # rounding before inversion can shift a grey value by one level
+    assert np.abs(grey32.astype(int) - grey64.astype(int)).max() <= 1
+    assert np.mean(grey32 != grey64) < 0.01
+
+    valid = (rad64 > 0) & (rad32 > 0)
+    rel_err = np.abs(rad32[valid] - rad64[valid]) / rad64[valid]
+    assert np.median(rel_err) < 1e-6
+    assert rel_err.max() < 2e-3
+
+
+def test_explicit_dtype_overrides_global(calibrated_slide):
+    rgb, fields, popt = calibrated_slide
+    set_precision('float64')
+    grey = rgb_to_grey(rgb, flatfield_corr=fields, invert=True, dtype=np.float32)
+    assert inverse_rodbard(grey, *popt, dtype=np.float32).dtype == np.float32
+    assert inverse_rodbard(grey, *popt).dtype == np.float64
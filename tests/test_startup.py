@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_DEPENDENCIES = [
+    'matplotlib',
+    'nibabel',
+    'pandas',
+    'PIL',
+    'rawpy',
+    'scipy',
+    'skimage',
+]
+
+
+@pytest.mark.parametrize(
+    'module',
+    ['nmriprep.argprep.argprep', 'nmriprep.argprep.fieldprep', 'nmriprep.measure'],
+)
+def test_entry_point_import_is_lightweight(module):
+    """Entry points must not import heavy dependencies at module import time"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = {
+        line.split('|')[-1].strip().split('.')[0]
+        for line in result.stderr.splitlines()
+        if line.startswith('import time:')
+    }
+    assert imported.isdisjoint(HEAVY_DEPENDENCIES)
@@ -0,0 +1,58 @@
+import os
+import time
+
+import pytest
+
+from nmriprep.argprep.workqueue import read_task, run_worker, submit_tasks, write_task
+
+
+@pytest.fixture
+def queue_dir(tmp_path):
+    submit_tasks(tmp_path, ['01', '02', '03'])
+    # a claim left behind by a node that crashed on its first attempt
+    task = read_task(tmp_path / 'pending' / '01.json')
+    task.update(attempts=1, worker='crashed-node')
+    claimed = tmp_path / 'claimed' / '01.json'
+    write_task(claimed, task)
+    (tmp_path / 'pending' / '01.json').unlink()
+    old = time.time() - 3600
+    os.utime(claimed, (old, old))
+    return tmp_path
+
+
+def test_run_worker(queue_dir):
+    calls = []
+
+    def process(subject, p0):
+        calls.append((subject, p0))
+        if subject == '02':
+            raise RuntimeError('corrupt standards')
+        return subject
+
+    run_worker(queue_dir, process, max_attempts=2, stale_after=1, poll_interval=0.1)
+
+    assert sorted(p.name for p in (queue_dir / 'done').iterdir()) == [
+        '01.json',
+        '03.json',
+    ]
+    assert [p.name for p in (queue_dir / 'failed').iterdir()] == ['02.json']
+    assert not any((queue_dir / 'pending').iterdir())
+    assert not any((queue_dir / 'claimed').iterdir())
+    assert [subject for subject, _ in calls].count('02') == 2
+    # each subject is warm started from the last one processed successfully
+    last = None
+    for subject, p0 in calls:
+        assert p0 == last
+        if subject != '02':
+            last = subject
+
+    reclaimed = read_task(queue_dir / 'done' / '01.json')
+    assert reclaimed['attempts'] == 2
+    assert reclaimed['history'][0]['worker'] == 'crashed-node'
+    assert 'reclaimed' in reclaimed['history'][0]
+    assert reclaimed['history'][1]['error'] is None
+
+    failed = read_task(queue_dir / 'failed' / '02.json')
+    assert failed['attempts'] == 2
+    assert len(failed['history']) == 2
+    assert all('corrupt standards' in entry['error'] for entry in failed['history'])